@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import os
+import sys
 from sabr_pkg.SMPC_ugv import *
 from sabr_pkg.SMPC_uav import *
 from sabr_pkg.ROS_interface_ugv_uav import *
@@ -10,12 +12,12 @@ from sabr_pkg.ROS_interface_ugv_uav import *
 # both robots reach their # final goal destination, if their SMPC controller succeeds in finding solutions, and
 # if uncertainty is always below a specified threshold.
 
-# initialize obstacles
+# initialize obstacles (the vertices of polygon obstacles in clockwise order)
 
-obs = {1: {'vertices': [[-3.+5, -1+5,0], [-3.02+5, 1.03+5,0], [3+5,1+5,0], [3.02+5, -1.05+5,0]], 'a': [], 'slopes': [], 'intercepts': [],
+obs = {1: {'vertices': [[-3.+5, -1+5,0], [-3.02+5, 1.03+5,0], [3+5,1+5,0], [3.02+5, -1.05+5,0]], 'a': [],
                'polygon_type': 4, 'risk': 0.4}}
 obs.update(
-        {2: {'vertices': [[6, 5,0], [7, 7,0], [8, 5.2,0]], 'a': [], 'slopes': [], 'intercepts': [], 'polygon_type': 3,
+        {2: {'vertices': [[6, 5,0], [7, 7,0], [8, 5.2,0]], 'a': [], 'polygon_type': 3,
              'risk': 0.4}})
 obs.update({3: {'vertices': [[2, 2]], 'size': 0.5, 'polygon_type': 1, 'risk': 0.4}})
 
@@ -24,9 +26,16 @@ obs.update({3: {'vertices': [[2, 2]], 'size': 0.5, 'polygon_type': 1, 'risk': 0.
 dT = 0.5
 mpc_horizon = 10
 animate = True
+# the animation is redrawn every animate_every iterations of the control loop
+animate_every = 1
+# with --profile, the solver timings of the first UGV solve are printed, to see whether the NLP function evaluations
+# or the solver itself is the bottleneck
+profile = '--profile' in sys.argv
 
 # initialize SMPC parameters for the UGV
-curr_posUGV = np.array([0, 0, 0]).reshape(3,1)
+curr_posUGV = np.array([0, 0, 0], dtype=float).reshape(3,1)
+# position of the UGV (x, y, and z = 0) used to check the obstacles, reused in every iteration
+obs_posUGV = np.zeros(3)
 goal_pointsUGV = [[10, 10, 0], [0, 0, 0]]
 robot_size = 0.5
 lb_state = np.array([[-20], [-20], [-2*pi]], dtype=float)
@@ -42,10 +51,14 @@ angle_noise_r2 = 0.0
 relative_measurement_noise_cov = np.array([[0.0,0], [0,0.0]])
 maxComm_distance = -10
 failure_count = 0
+# the compiled UGV solver is cached between runs in the user's cache directory
+solver_cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                'sabr_pkg')
 
 SMPC_UGV = SMPC_UGV_Planner(dT, mpc_horizon, curr_posUGV, robot_size, lb_state,
                             ub_state, lb_control, ub_control, Q, R_init, angle_noise_r1, angle_noise_r2,
-                            relative_measurement_noise_cov, maxComm_distance, obs, animate)
+                            relative_measurement_noise_cov, maxComm_distance, obs, animate,
+                            solver_cache_dir=solver_cache_dir)
 
 
 # initialize SMPC parameters for the UAV
@@ -108,22 +121,28 @@ rate = rospy.Rate(10)
 #curr_posUGV[2] = curr_posROS[2]
 #SMPC_UGV.opti.set_value(SMPC_UGV.r1_pos, curr_posUGV)
 
-while m.sqrt((curr_posUGV[0] - goal_posUGV[0]) ** 2 + (curr_posUGV[1] - goal_posUGV[1]) ** 2) > 0.5 or m.sqrt((curr_posUAV[0]
-            - goal_posUAV[0]) ** 2 + (curr_posUAV[4] - goal_posUAV[4]) ** 2 + (curr_posUAV[8] - goal_posUAV[8])**2) > 0.5:
+# a goal is reached within a distance of 0.5, compared with squared distances to avoid the square roots
+goal_tolerance_sq = 0.5**2
+step = 0
+
+while (curr_posUGV[0] - goal_posUGV[0]) ** 2 + (curr_posUGV[1] - goal_posUGV[1]) ** 2 > goal_tolerance_sq or ((curr_posUAV[0]
+            - goal_posUAV[0]) ** 2 + (curr_posUAV[4] - goal_posUAV[4]) ** 2 + (curr_posUAV[8] - goal_posUAV[8])**2) > goal_tolerance_sq:
 
     # find SMPC solution for UGV
     try:
-        solUGV = SMPC_UGV.opti.solve()
-        uUGV = solUGV.value(SMPC_UGV.U[:, 0])
+        _, U_UGV = SMPC_UGV.solve()
+        if profile:
+            print(SMPC_UGV.solver_timings())
+            profile = False
+        uUGV = U_UGV[:, 0]
         ROS.send_velocity(uUGV)
-        curr_posUGV = ROS.get_current_pose()
-        curr_posUGV = np.array(curr_posUGV).reshape(3, 1)
-        print(curr_posUGV)
-        SMPC_UGV.check_obstacles(np.concatenate((curr_posUGV[0], curr_posUGV[1], [0])))
+        curr_posUGV[:, 0] = ROS.get_current_pose()
+        obs_posUGV[0:2] = curr_posUGV[0:2, 0]
+        SMPC_UGV.check_obstacles(obs_posUGV)
     except:
-        curr_posUGV = ROS.get_current_pose()
-        curr_posUGV = np.array(curr_posUGV).reshape(3, 1)
-        SMPC_UGV.check_obstacles(np.concatenate((curr_posUGV[0], curr_posUGV[1], [0])))
+        curr_posUGV[:, 0] = ROS.get_current_pose()
+        obs_posUGV[0:2] = curr_posUGV[0:2, 0]
+        SMPC_UGV.check_obstacles(obs_posUGV)
 
     SMPC_UGV.opti.set_value(SMPC_UGV.r1_pos, curr_posUGV)
 
@@ -149,26 +168,27 @@ while m.sqrt((curr_posUGV[0] - goal_posUGV[0]) ** 2 + (curr_posUGV[1] - goal_pos
 
     SMPC_UAV.opti.set_value(SMPC_UAV.r_pos, curr_posUAV)
 
-    dist_goalUGV = m.sqrt((curr_posUGV[0] - goal_posUGV[0]) ** 2 + (curr_posUGV[1] - goal_posUGV[1]) ** 2)
-    dist_goalUAV = m.sqrt((curr_posUAV[0]
-                           - goal_posUAV[0]) ** 2 + (curr_posUAV[4] - goal_posUAV[4]) ** 2 + (
-                                      curr_posUAV[8] - goal_posUAV[8]) ** 2)
+    dist_goalUGV_sq = (curr_posUGV[0] - goal_posUGV[0]) ** 2 + (curr_posUGV[1] - goal_posUGV[1]) ** 2
+    dist_goalUAV_sq = (curr_posUAV[0] - goal_posUAV[0]) ** 2 + (curr_posUAV[4] - goal_posUAV[4]) ** 2 + (
+                                      curr_posUAV[8] - goal_posUAV[8]) ** 2
 
-    if dist_goalUGV < 0.5 and indexUGV <= len(goal_pointsUGV) - 1:
+    if dist_goalUGV_sq < goal_tolerance_sq and indexUGV <= len(goal_pointsUGV) - 1:
         goal_posUGV = np.array(goal_pointsUGV[indexUGV])
         SMPC_UGV.opti.set_value(SMPC_UGV.r1_goal, goal_posUGV)
         indexUGV += 1
 
-    if dist_goalUAV < 0.5 and indexUAV <= len(goal_pointsUAV) - 1:
+    if dist_goalUAV_sq < goal_tolerance_sq and indexUAV <= len(goal_pointsUAV) - 1:
         goal_posUAV = np.array(goal_pointsUAV[indexUAV])
         SMPC_UAV.opti.set_value(SMPC_UAV.r_goal, goal_posUAV)
         indexUAV += 1
 
-    SMPC_UGV.animate(curr_posUGV)
-    SMPC_UAV.animate_multi_agents(SMPC_UGV.ax, curr_posUAV)
+    if animate and step % animate_every == 0:
+        SMPC_UGV.animate(curr_posUGV)
+        SMPC_UAV.animate_multi_agents(SMPC_UGV.ax, curr_posUAV)
+        plt.show()
+        plt.pause(0.001)
+    step += 1
     rate.sleep()
-    plt.show()
-    plt.pause(0.001)
 
     """
     # find SMPC solution for UGV
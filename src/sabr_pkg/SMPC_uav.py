@@ -90,8 +90,9 @@ class SMPC_UAV_Planner():
                                    lambda event: [exit(0) if event.key == 'escape' else None])
                 self.ax = fig.add_subplot(111, projection='3d')
                 self.ax = Axes3D(fig)
-            u = np.linspace(0, 2 * np.pi, 100)
-            v = np.linspace(0, np.pi, 100)
+            # a coarse sphere is sufficient to mark the robot, and is much cheaper to redraw every frame
+            u = np.linspace(0, 2 * np.pi, 16)
+            v = np.linspace(0, np.pi, 16)
             self.x_fig = np.outer(self.robot_size * np.cos(u), np.sin(v))
             self.y_fig = np.outer(self.robot_size * np.sin(u), np.sin(v))
             self.z_fig = np.outer(self.robot_size * np.ones(np.size(u)), np.cos(v))
@@ -259,7 +260,7 @@ class SMPC_UAV_Planner():
         self.ax.set_zlim(0, 10)
         # graph robot as a round sphere for simplicity
         self.ax.plot_surface(self.x_fig + curr_pos[0], self.y_fig + curr_pos[4], self.z_fig + curr_pos[8],
-                             rstride=4, cstride=4, color='b')
+                             rstride=1, cstride=1, color='b')
 
         for i in range(1, len(self.obs) + 1):
             if self.obs[i]['polygon_type'] == 1:
@@ -275,7 +276,7 @@ class SMPC_UAV_Planner():
         ax.set_zlim(0, 10)
         # graph robot as a round sphere for simplicity
         ax.plot_surface(self.x_fig + curr_pos[0], self.y_fig + curr_pos[4], self.z_fig + curr_pos[8],
-                             rstride=4, cstride=4, color='b')
+                             rstride=1, cstride=1, color='b')
         x_togo = 2 * np.cos(0)
         y_togo = 2 * np.sin(0)
 
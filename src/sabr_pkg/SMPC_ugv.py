@@ -12,17 +12,86 @@ from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 import mpl_toolkits.mplot3d.art3d as art3d
 from matplotlib.patches import Circle
 from scipy.spatial import distance
+from scipy import special
 import matplotlib.pyplot as plt
 import math as m
 import control
-from scipy.stats import linregress
+import os
+import hashlib
+import platform
+import tempfile
+import shutil
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+# numba is optional, without it the numeric kalman update below runs as plain python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda function: function
 #from ROS_interface import *
 
+def host_cpu():
+    # model and instruction set extensions of the host cpu, which a binary compiled with -march=native depends on
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            return sorted(set(line.strip() for line in cpuinfo if line.startswith(('model name', 'flags'))))
+    except (IOError, OSError):
+        return platform.processor()
+
+@njit(cache=True, fastmath=True)
+def inv2(M, eps=1e-12):
+    # closed form inverse of a 2x2 matrix, a (near) singular matrix is regularized by shifting its determinant by eps,
+    # relative to the scale of the matrix (so that small but well conditioned matrices are inverted exactly)
+    det = M[0, 0]*M[1, 1] - M[0, 1]*M[1, 0]
+    tol = eps * max(abs(M[0, 0]), abs(M[0, 1]), abs(M[1, 0]), abs(M[1, 1]))**2
+    if tol == 0:
+        # the zero matrix, its regularized inverse is the zero matrix
+        tol = eps
+    if abs(det) < tol:
+        det = det + tol
+    M_inv = np.empty((2, 2))
+    M_inv[0, 0] = M[1, 1] / det
+    M_inv[0, 1] = -M[0, 1] / det
+    M_inv[1, 0] = -M[1, 0] / det
+    M_inv[1, 1] = M[0, 0] / det
+    return M_inv
+
+@njit(cache=True, fastmath=True)
+def kalman_update_2x2(P11, P22, P12, R12):
+    # kalman update of the relative measurement between robot 1 and 2, with the 2x2 system noise covariance matrices
+    # P11 and P22 of robot 1 and 2, their cross covariance P12, and the relative measurement uncertainty R12. Returns
+    # the kalman gain K, and the updated covariance matrix of robot 1 and cross covariance P12
+
+    # TODO: the P21 term must come from robot 2 (CHANGE in the future)
+    # calculate the S matrix
+    P21 = P12.T
+    S = P11 - P12 - P21 + P22 + R12
+
+    # calculate the inverse S matrix, regularized so that it exists for a singular S
+    S_inv = inv2(S)
+
+    # calculate the kalman gain K
+    K = np.dot(P11 - P12, S_inv)
+
+    # update the covariance system noise matrix of robot 1 with the updated matrix
+    P11_update = P11 - np.dot(K, P11 - P21)
+
+    # update the covariance system noise matrix for robot 1 and 2
+    P12_update = np.dot(np.dot(P11, S_inv), P22)
+
+    return K, P11_update, P12_update
+
 class SMPC_UGV_Planner():
 
     def __init__(self, dT, mpc_horizon, curr_pos, robot_size, lb_state,
                  ub_state, lb_control, ub_control, Q, R, angle_noise_r1, angle_noise_r2,
-                 relative_measurement_noise_cov, maxComm_distance, obs, animate):
+                 relative_measurement_noise_cov, maxComm_distance, obs, animate, linear_solver='mumps',
+                 solver_cache_dir=None):
+        """Builds the SMPC problem and its solver. While the solver is compiled (see build_solver), the working
+        directory of the process is changed temporarily, so building the planner is not thread-safe."""
 
         # initialize Optistack class
         self.opti = casadi.Opti()
@@ -45,8 +114,8 @@ class SMPC_UGV_Planner():
         self.Q = Q
         self.R_dare = R
         self.R = np.array([[R[0,0], 0], [0, R[2,2]]])
-        # initialize discretized state matrices A and B (note, A is constant, but B will change as it is a function of
-        # state theta)
+        # initialize discretized state matrices A and B, both are constant and only used to calculate the terminal cost
+        # below (the dynamics are built directly in next_state_nominal)
         self.A = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
         self.B = np.array([[self.dT, 0, 0], [0, self.dT, 0], [0, 0, self.dT]])
         # initialize the P matrix, which is the cost matrix that defines the optimal state feedback controller
@@ -63,8 +132,18 @@ class SMPC_UGV_Planner():
         self.angle_noise_r2 = angle_noise_r2
         # initialize the maximum distance that robot 1 and 2 are allowed to have for cross communication
         self.maxComm_distance = maxComm_distance
+        # cooperative localization (see update_2) is disabled by setting a non-positive maximum communication distance
+        self.cooperative_localization = self.maxComm_distance > 0
+        # the squared distance is used to compare the distance between the robots, avoiding the square root
+        self.maxComm_distance_sq = self.maxComm_distance**2
         # distance to obstacle to be used as constraints
         self.max_obs_distance = 20
+        # linear solver used by ipopt for the KKT system, e.g. 'ma27' or 'ma57' (both require the HSL
+        # library to be installed) are faster than the default 'mumps' on the banded structure of this problem
+        self.linear_solver = linear_solver
+        # directory where the compiled solver is cached between runs, e.g. ~/.cache/sabr_pkg (by default None, the
+        # solver is always rebuilt)
+        self.solver_cache_dir = solver_cache_dir
         # initialize obstacles
         self.obs = obs
         # initialize robot's current position
@@ -73,10 +152,8 @@ class SMPC_UGV_Planner():
         # initialize the current positional uncertainty (and add the robot size to it)
         # TODO: this is a temporary fix for testing
         self.r1_cov_curr = np.array([[0.1 + self.robot_size, 0], [0, 0.1 + self.robot_size]])
-        # initialize cross diagonal system noise covariance matrix
-        self.P12 = np.array([[0, 0], [0, 0]])
-        # bool variable to indicate whether the robot has made first contact with the uav
-        self.first_contact = False
+        # direction used for the chance constraints of circular obstacles
+        self.a_circle = np.array([1, 1])
         # initialize state, control, and slack variables
         self.initVariables()
         # initialize states for DQN (relative distance between robot-goal, and robot-obstacles
@@ -92,11 +169,15 @@ class SMPC_UGV_Planner():
                                    lambda event: [exit(0) if event.key == 'escape' else None])
             self.ax = fig.add_subplot(111, projection='3d')
             self.ax = Axes3D(fig)
-            u = np.linspace(0, 2 * np.pi, 100)
-            v = np.linspace(0, np.pi, 100)
+            # a coarse sphere is sufficient to mark the robot, and is much cheaper to redraw every frame
+            u = np.linspace(0, 2 * np.pi, 16)
+            v = np.linspace(0, np.pi, 16)
             self.x_fig = np.outer(self.robot_size * np.cos(u), np.sin(v))
             self.y_fig = np.outer(self.robot_size * np.sin(u), np.sin(v))
             self.z_fig = np.outer(self.robot_size * np.ones(np.size(u)), np.cos(v))
+            # buffers for the sphere translated to the current robot position, reused in every frame
+            self.x_fig_curr = np.empty_like(self.x_fig)
+            self.y_fig_curr = np.empty_like(self.y_fig)
 
     def initVariables(self):
 
@@ -105,7 +186,9 @@ class SMPC_UGV_Planner():
         self.x_pos = self.X[0,:]
         self.y_pos = self.X[1,:]
         self.th = self.X[2, :]
-        self.opti.set_initial(self.X, 0)
+        # the first solve starts from the robot standing still at its current position, following solves are warm
+        # started from the shifted previous solution (see solve)
+        self.opti.set_initial(self.X, repmat(self.curr_pos, 1, self.N+1))
 
         # initialize, linear and angular velocity control variables (v, and w), and repeat above procedure
         self.U = self.opti.variable(2, self.N)
@@ -130,33 +213,46 @@ class SMPC_UGV_Planner():
         # initialize the uncertainty covariances from the RNN, provided by robot 1 (4 x 1 vector per covariance matrix)
         # must be positive semi-definite, from t+1 to N
         self.r1_pos_cov = self.opti.parameter(4, self.N+1)
-        self.opti.set_value(self.r1_pos_cov, 0)
+        self.opti.set_value(self.r1_pos_cov, DM.zeros(4, self.N+1))
 
         # initialize the uncertainty covariances from the RNN, provided by robot 2 (4 x 1 vector per covariance matrix)
         # must be positive semi-definite, from t+1 to N
         self.r2_pos_cov = self.opti.parameter(4, self.N+1)
-        self.opti.set_value(self.r2_pos_cov, 0)
+        self.opti.set_value(self.r2_pos_cov, DM.zeros(4, self.N+1))
 
         # initialize robot 2, future positions (x, y, and th), from t+1 to N
         self.r2_traj = self.opti.parameter(3, self.N+1)
-        self.opti.set_value(self.r2_traj, 0)
+        self.opti.set_value(self.r2_traj, DM.zeros(3, self.N+1))
+
+        # initialize the system noise of robot 1 (x, y, and th), from t to N-1, sampled from the covariances above
+        self.system_noise = self.opti.parameter(3, self.N)
+        self.opti.set_value(self.system_noise, DM.zeros(3, self.N))
+
+        # initialize the kalman gains of robot 1 (flattened 2x2 matrix per time step) for the cooperative localization
+        # update, from t to N-1
+        self.kalman_gain = self.opti.parameter(4, self.N)
+        self.opti.set_value(self.kalman_gain, DM.zeros(4, self.N))
 
         # initialize the objective function
         self.obj()
 
     def obj(self):
 
-        self.objFunc = 0
-
-        for k in range(0, self.N-1):
-            con = self.U[:, k]
-            st = self.X[:, k + 1]
-
-            self.objFunc = self.objFunc + mtimes(mtimes((st - self.r1_goal).T, self.Q), st - self.r1_goal) + \
-                           0.5*mtimes(mtimes(con.T, self.R), con) + self.slack[:, k+1]*self.slack_cost
+        # the stage cost is defined once for a single time step and mapped over the horizon (states X[:, 1:N] and
+        # controls U[:, 0:N-1]), instead of building a separate expression for every time step
+        st = SX.sym('st', 3)
+        con = SX.sym('con', 2)
+        goal = SX.sym('goal', 3)
+        stage_cost = Function('stage_cost', [st, con, goal], [bilin(self.Q, st - goal, st - goal) +
+                                                            0.5*bilin(self.R, con, con)])
+        stage_costs = stage_cost.map(self.N-1)(self.X[:, 1:self.N], self.U[:, 0:self.N-1],
+                                               repmat(self.r1_goal, 1, self.N-1))
+        # every slack is penalized, including the one of the current time step (which only relaxes the obstacle
+        # constraints of the fixed current state), so that no slack is left as a free variable in the problem
+        self.objFunc = sum2(stage_costs) + sum2(self.slack)*self.slack_cost
 
         st = self.X[:, self.N]
-        self.objFunc = self.objFunc + mtimes(mtimes((st - self.r1_goal).T, self.P), st - self.r1_goal) + self.slack[:,self.N]*self.slack_cost
+        self.objFunc = self.objFunc + bilin(self.P, st - self.r1_goal, st - self.r1_goal)
 
         # initialize the constraints for the objective function
         self.init_constraints()
@@ -172,12 +268,32 @@ class SMPC_UGV_Planner():
         self.opti.subject_to(self.slack >= 0)
 
         # initiate multiple shooting constraints
-        for k in range(0, self.N):
-             next_state = if_else((sqrt((self.X[0, k] - self.r2_traj[0, k])**2 +
-                                      (self.X[1, k] - self.r2_traj[1, k]**2)) >= self.maxComm_distance),
-                                 self.update_1(self.X[:,k], self.U[0:2,k]), self.update_2(self.X[:,k], self.U[0:2,k], k))
-
-             self.opti.subject_to(self.X[:,k + 1] == next_state)
+        if self.cooperative_localization:
+            # the kalman gains do not depend on the optimized states, they are parameters calculated from the system
+            # noise covariances of robot 1 and 2 (and recalculated in solve, whenever the covariances change)
+            self.update_kalman_gains()
+
+            # the next state is the nominal state if robot 2 is outside of communication distance, and the state
+            # updated by the cooperative localization otherwise. The time step is defined once and mapped over the
+            # horizon
+            x = SX.sym('x', 3)
+            u = SX.sym('u', 2)
+            x_r2 = SX.sym('x_r2', 2)
+            w = SX.sym('w', 3)
+            K = SX.sym('K', 4)
+            step = Function('step', [x, u, x_r2, w, K],
+                            [if_else(sumsqr(x[0:2] - x_r2) >= self.maxComm_distance_sq,
+                                     self.update_1(x, u), self.update_kalman(x, u, w, reshape(K, 2, 2)))])
+            self.opti.subject_to(self.X[:, 1:] == step.map(self.N)(self.X[:, 0:self.N], self.U,
+                                                                   self.r2_traj[0:2, 0:self.N], self.system_noise,
+                                                                   self.kalman_gain))
+        else:
+            # robot 2 is never within communication distance, only the (smooth) nominal dynamics are needed, which are
+            # defined once for a single time step and mapped over the horizon
+            x = SX.sym('x', 3)
+            u = SX.sym('u', 2)
+            dynamics = Function('dynamics', [x, u], [self.update_1(x, u)])
+            self.opti.subject_to(self.X[:, 1:] == dynamics.map(self.N)(self.X[:, 0:self.N], self.U))
 
         if self.obs:
             # initialize obstacles, animate them, and also constrain them for the MPC
@@ -190,46 +306,22 @@ class SMPC_UGV_Planner():
         self.pre_solve()
 
     def init_obstacles(self, obstacles, animate):
-        # receive the slope, intercepts, of the obstacles for chance constraints, and plot
+        # receive the unit normal vectors of the polygon edges for the chance constraints, and plot. The normal of each
+        # edge is the edge rotated counter clockwise, which points out of the polygon only if its vertices are given in
+        # clockwise order (for counter clockwise vertices all normals point inwards, and the constraints are flipped)
         for i in range(1, len(obstacles)+1):
-            it = 0
-            slopes = []
-            intercepts = []
-            a_vectors = np.empty((2, obstacles[i]['polygon_type']))
 
             if obstacles[i]['polygon_type'] != 1:
 
-                for j in range(0, obstacles[i]['polygon_type']):
-
-                    if it == obstacles[i]['polygon_type']-1:
-                        point_1 = obstacles[i]['vertices'][-1]
-                        point_2 = obstacles[i]['vertices'][0]
-
-                    else:
-                        point_1 = obstacles[i]['vertices'][it]
-                        point_2 = obstacles[i]['vertices'][it+1]
-
-                    it += 1
-
-                    x = [point_1[0], point_2[0]]
-                    y = [point_1[1], point_2[1]]
-                    _, intercept, _, _, _ = linregress(x, y)
-
-                    a_x = x[1] - x[0]
-                    a_y = y[1] - y[0]
-                    slope = a_y / a_x
-                    distance = np.sqrt(a_x**2 + a_y**2)
-                    slopes.append(slope)
-                    a_norm = np.array([a_x / distance, a_y / distance], dtype=float).reshape(2, 1)
+                # the edges of the polygon go from each vertex to the next one (and from the last to the first vertex)
+                vertices = np.asarray(obstacles[i]['vertices'], dtype=float)[:, 0:2]
+                edges = np.roll(vertices, -1, axis=0) - vertices
+                distance = np.sqrt(np.sum(edges**2, axis=1))
 
-                    # rotate the a_norm counter clockwise
-                    a_norm = np.array([a_norm[1]*-1, a_norm[0]], dtype=float).reshape(1, 2)
-                    a_vectors[:, j] = a_norm
-                    intercepts = np.append(intercepts, intercept)
+                # the normalized edges rotated counter clockwise
+                a_vectors = np.vstack((-edges[:, 1], edges[:, 0])) / distance
 
                 obstacles[i]['a'] = a_vectors
-                obstacles[i]['slopes'] = slopes
-                obstacles[i]['intercepts'] = intercepts
             self.obs = obstacles
 
         if animate:
@@ -257,52 +349,33 @@ class SMPC_UGV_Planner():
     def chance_constraints(self):
 
         # Using chance constraints on polygon obstacles
-        # create integer variable for chance constraints
         self.obs_indexL = []
         for i in range(1, len(self.obs)+1):
             if self.obs[i]['polygon_type'] != 1:
                 self.obs_indexL.append(self.obs[i]['polygon_type'])
 
-        self.I = self.opti.variable(sum(self.obs_indexL), 1)
-        # provide constraints on the integer variable
-        self.opti.subject_to(self.opti.bounded(0, self.I, 1))
+        # initialize the edge for chance constraints of each polygon, a polygon is avoided by staying on the outer side
+        # of one of its edges, given by the unit normal vector a and offset b of its line (a*x = b). The edge is chosen
+        # in check_obstacles for every time step, so that the solver only sees one linear constraint per polygon and
+        # time step (instead of one per edge, and an integer variable to select the edge)
+        self.edge_a = self.opti.parameter(2, len(self.obs_indexL))
+        self.opti.set_value(self.edge_a, 0)
+        self.edge_b = self.opti.parameter(1, len(self.obs_indexL))
+        self.opti.set_value(self.edge_b, 0)
 
         # set chance constraints for obstacles
         # initialize c parameter for chance constraint equation, this value will change for each time step
-        self.cl = self.opti.parameter(sum(self.obs_indexL), self.N+1)
+        self.cl = self.opti.parameter(len(self.obs_indexL), self.N+1)
         self.opti.set_value(self.cl, 1)
 
         # initialize a switch variable, to turn off or on obstacle constraints if the obstacle is not in a desired range
         self.switch_obsL = self.opti.parameter(len(self.obs_indexL), 1)
         self.opti.set_value(self.switch_obsL, 0)
 
-        # initialize integer constraints
-        iter_2 = 0
         for i in range(0, len(self.obs_indexL)):
-            sum_I = 0
-            iter_1 = iter_2
-            iter_2 = iter_2 + self.obs_indexL[i]
-            for j in range(iter_1, iter_2):
-                sum_I = sum_I + self.I[j]
-            self.opti.subject_to(sum_I >= 1)
-
-        iter_2 = 0
-        for i in range(0, len(self.obs_indexL)):
-            iter_1 = iter_2
-            iter_2 = iter_2 + self.obs_indexL[i]
-            index_slope_intercept = 0
-            r = self.obs[i + 1]['risk']
-
-            for j in range(iter_1, iter_2):
-                a = self.obs[i + 1]['a'][:, index_slope_intercept]
-                b = self.obs[i + 1]['intercepts'][index_slope_intercept]
-                m = self.obs[i + 1]['slopes'][index_slope_intercept]
-                self.opti.set_value(self.cl[j,:], np.sqrt(np.dot(np.dot(2 * np.transpose(a), self.r1_cov_curr), a)) * erfinv((1 - 2 * r)))
-                index_slope_intercept += 1
-
-                for k in range(0, self.N+1):
-                    dist = self.distance_pt_line(m, a, b, self.X[0:2,k])
-                    self.opti.subject_to(self.switch_obsL[i]*dist * self.I[j] >= self.cl[j,k] * self.I[j] * self.switch_obsL[i] - self.slack[0,k])
+            # the signed distances to the line of the edge are calculated for all time steps of the horizon at once
+            dist = mtimes(self.edge_a[:, i].T, self.X[0:2, :]) - self.edge_b[i]
+            self.opti.subject_to(self.switch_obsL[i]*dist >= self.cl[i,:] * self.switch_obsL[i] - self.slack)
 
         # Using chance constraints on circular obstacles
         self.obs_indexC = []
@@ -319,27 +392,39 @@ class SMPC_UGV_Planner():
         for i in range(1, len(self.obs)+1):
             iter = 0
             if self.obs[i]['polygon_type'] == 1:
-                a = np.array([1,1]).reshape(2,1)
                 r = self.obs[i]['risk']
                 center = self.obs[i]['vertices'][0]
                 size = self.obs[i]['size']
 
-                self.opti.set_value(self.cc[iter,:],
-                                np.sqrt(np.dot(np.dot(2 * np.transpose(a), self.r1_cov_curr), a)) * erfinv((1 - 2 * r)))
+                self.opti.set_value(self.cc[iter,:], self.chance_margin(self.a_circle, r))
 
-                for k in range(0, self.N+1):
-                    dist = -1 * self.distance_pt_circle(center, self.X[0:2,k],size, self.robot_size) + self.cc[iter] - self.slack[0, k]
-                    self.opti.subject_to(self.switch_obsC[iter]*dist <= 0)
+                dist = -1 * self.distance_pt_circle(center, [self.X[0, :], self.X[1, :]], size, self.robot_size) + self.cc[iter, :] - self.slack
+                self.opti.subject_to(self.switch_obsC[iter]*dist <= 0)
                 iter += 1
 
+    def chance_margin(self, a, risk):
+        # margin of the chance constraint with normal vector a, for the current positional uncertainty of the robot and
+        # the accepted risk of collision with the obstacle. For a 2xM matrix a (and M risks), the margins of all M
+        # normal vectors are calculated at once
+        # (for a risk of 0.5 the inverse error function is zero, and so is the margin)
+        risk_factor = special.erfinv(1 - 2 * np.asarray(risk, dtype=float))
+        if not np.any(risk_factor):
+            return 0 * risk_factor
+        return np.sqrt(2 * np.einsum('i...,ij,j...->...', a, self.r1_cov_curr, a)) * risk_factor
+
     def check_obstacles(self, curr_pos):
         # this function is run to update obstacle constraints for all timesteps of the MPC prediction horizon
 
         iter = 0
         iter2 = 0
-        obs_iter2 = 0
         ind_dqn = 0
 
+        # the selected edges of the polygons (and their risk and switch) are collected, and set for all polygons at once
+        edge_a = np.zeros((2, len(self.obs_indexL)))
+        edge_b = np.zeros(len(self.obs_indexL))
+        edge_risk = np.full(len(self.obs_indexL), 0.5)
+        switch_obsL = np.zeros(len(self.obs_indexL))
+
         #self.dqn_states[0] = distance.euclidean((curr_pos[0], curr_pos[1]), (goal_pos[0], goal_pos[1]))
         for i in range(1, len(self.obs)+1):
 
@@ -362,27 +447,20 @@ class SMPC_UGV_Planner():
 
                     if dist <= self.max_obs_distance and not break_now:
 
-                        obs_iter1 = obs_iter2
-                        obs_iter2 = obs_iter2 + self.obs_indexL[iter]
-
-                        index_slope_intercept = 0
-                        r = self.obs[i]['risk']
-
-                        for l in range(obs_iter1, obs_iter2):
-                            a = self.obs[i]['a'][:, index_slope_intercept]
-
-                            for k in range(0, self.N+1):
-                                # self.r1_cov_curr[0,:] = self.r1_pos_cov[0:2,k]
-                                # self.r1_cov_curr[1, :] = self.r1_pos_cov[2:4,k]
-                                self.opti.set_value(self.cl[l, k], np.sqrt(
-                                        np.dot(np.dot(2 * np.transpose(a), self.r1_cov_curr), a)) * erfinv((1 - 2 * r)))
-
-                            index_slope_intercept += 1
-
-                        self.opti.set_value(self.switch_obsL[iter], 1)
+                        # select the edge that the robot is the farthest on the outer side of (the largest signed
+                        # distance between the current position and the lines through the edges), only this edge is
+                        # constrained for the whole horizon. The signed distances are only positive outside of the
+                        # polygon for clockwise vertices (see init_obstacles)
+                        vertices = np.asarray(self.obs[i]['vertices'], dtype=float)[:, 0:2]
+                        position = np.asarray(curr_pos[0:2], dtype=float).reshape(2, 1)
+                        signed_dist = np.sum(self.obs[i]['a'] * (position - vertices.T), axis=0)
+                        edge = np.argmax(signed_dist)
+                        edge_a[:, iter] = self.obs[i]['a'][:, edge]
+                        edge_b[iter] = np.dot(edge_a[:, iter], vertices[edge])
+                        edge_risk[iter] = self.obs[i]['risk']
+
+                        switch_obsL[iter] = 1
                         break_now = True
-                    elif dist > self.max_obs_distance and not break_now:
-                        self.opti.set_value(self.switch_obsL[iter], 0)
 
                 iter += 1
 
@@ -393,15 +471,8 @@ class SMPC_UGV_Planner():
                 self.dqn_states[ind_dqn] = np.round(dist,2)
                 ind_dqn += 1
                 if dist <= self.max_obs_distance:
-                    a = np.array([1, 1]).reshape(2, 1)
                     r = self.obs[i]['risk']
-
-                    for k in range(0, self.N+1):
-                        #self.r1_cov_curr[0,:] = self.r1_pos_cov[0:2,k]
-                        #self.r1_cov_curr[1, :] = self.r1_pos_cov[2:4,k]
-                        self.opti.set_value(self.cc[iter2, k],
-                                        np.sqrt(np.dot(np.dot(2 * np.transpose(a), self.r1_cov_curr), a)) * erfinv(
-                                            (1 - 2 * r)))
+                    self.opti.set_value(self.cc[iter2, :], self.chance_margin(self.a_circle, r))
                     self.opti.set_value(self.switch_obsC[iter2], 1)
                     iter2 += 1
                     break
@@ -409,6 +480,14 @@ class SMPC_UGV_Planner():
                     self.opti.set_value(self.switch_obsC[iter2], 0)
                     iter2 += 1
                     break
+
+        if self.obs_indexL:
+            self.opti.set_value(self.edge_a, edge_a)
+            self.opti.set_value(self.edge_b, edge_b.reshape(1, -1))
+            # the margins are the same for all time steps, as long as r1_cov_curr is constant
+            margins = self.chance_margin(edge_a, edge_risk)
+            self.opti.set_value(self.cl, np.repeat(np.reshape(margins, (-1, 1)), self.N+1, axis=1))
+            self.opti.set_value(self.switch_obsL, switch_obsL)
     """
     def rotation_constraints(self):
         # rotation constraints can be used to ensure that the robot is directed along the path it is moving
@@ -425,222 +504,234 @@ class SMPC_UGV_Planner():
     """
 
     def pre_solve(self):
-        # initiate the solver called bonmin - performs Mixed-Integer Nonlinear Programming (MINLP)
-
-        # ensure states X, and controls U are continuous, while I variables are integers
-        OT_Boolvector_X = [0]*self.X.size()[0]*self.X.size()[1]
-        OT_Boolvector_U = [0]*self.U.size()[0]*self.U.size()[1]
-        OT_Boolvector_Slack = [0]*self.slack.size()[0]*self.slack.size()[1]
-        if self.obs:
-            OT_Boolvector_Int = [1] * self.I.size()[0] * self.I.size()[1]
+        # initiate the solver called ipopt, all variables are continuous as the edges for the chance constraints of the
+        # polygon obstacles are selected before every solve (see check_obstacles)
+
+        # the barrier parameter starts small (monotone) since each MPC step is warm started from the previous solution
+        opts = {'ipopt.warm_start_init_point': 'yes', 'error_on_fail': True, 'ipopt.max_cpu_time': 1.0,
+                'ipopt.acceptable_obj_change_tol': 1e40, 'ipopt.acceptable_tol': 1e-1, 'ipopt.sb': 'yes',
+                'ipopt.print_level': 0, 'ipopt.mu_strategy': 'monotone', 'ipopt.mu_init': 1e-6,
+                'ipopt.linear_solver': self.linear_solver}
+
+        # expand the MX graph built by the Opti stack to SX, which evaluates faster for a small problem like this one,
+        # independently of whether the functions are compiled below
+        opts['expand'] = True
+
+        # compile the NLP functions (objective, constraints and their derivatives) to a shared library, instead of
+        # evaluating them through the CasADi virtual machine at every solver iteration. Embedding the binary allows the
+        # compiled solver to be saved and loaded without compiling it again. Without gcc, the functions are evaluated by
+        # the virtual machine instead
+        jit = which('gcc') is not None
+        if jit:
+            opts.update({'jit': True, 'compiler': 'shell', 'jit_name': 'smpc_ugv', 'jit_cleanup': False,
+                         'jit_temp_suffix': False, 'jit_serialize': 'embed',
+                         'jit_options': {'compiler': 'gcc', 'flags': ['-O3', '-march=native', '-ffast-math'],
+                                         'verbose': False, 'cleanup': False}})
+
+        # create the solver once from the problem formulated with the Opti stack, so that every MPC step is a direct
+        # call of the solver function (see solve) rather than a round trip through the Opti bookkeeping
+        nlp = {'x': self.opti.x, 'p': self.opti.p, 'f': self.opti.f, 'g': self.opti.g}
+        if self.solver_cache_dir is None or not jit:
+            # only the compiled solver is cached, the uncompiled solver is cheap to build
+            self.solver = self.build_solver(nlp, opts)
         else:
-            OT_Boolvector_Int = []
-        OT_Boolvector = OT_Boolvector_X + OT_Boolvector_U + OT_Boolvector_Slack + OT_Boolvector_Int
-
-        opts = {'bonmin.warm_start': 'interior_point', 'discrete': OT_Boolvector, 'error_on_fail': True, 'bonmin.time_limit': 1.0,
-                'bonmin.acceptable_obj_change_tol': 1e40, 'bonmin.acceptable_tol': 1e-1, 'bonmin.sb': 'yes', 'bonmin.bb_log_level':0}
-
-        # create the solver
-        self.opti.solver('bonmin', opts)
+            # reuse the solver compiled by a previous run for the same problem (formulation, constants, and options),
+            # built by the same casadi version for the same type of host (the binary is compiled with -march=native)
+            problem = Function('problem', [self.opti.x, self.opti.p],
+                               [self.opti.f, self.opti.g, self.opti.lbg, self.opti.ubg]).serialize()
+            build = [CasadiMeta.version(), platform.platform(), platform.machine(), host_cpu()]
+            problem_hash = hashlib.sha1((problem + str(sorted(opts.items())) + str(build)).encode('utf-8')).hexdigest()
+            cache_file = os.path.join(self.solver_cache_dir, 'smpc_ugv_' + problem_hash + '.casadi')
+            self.solver = None
+            if os.path.exists(cache_file):
+                try:
+                    self.solver = Function.load(cache_file)
+                except RuntimeError:
+                    # a corrupt or incompatible cache file is replaced by a rebuilt solver
+                    self.solver = None
+            if self.solver is None:
+                if not os.path.isdir(self.solver_cache_dir):
+                    os.makedirs(self.solver_cache_dir)
+                self.solver = self.build_solver(nlp, opts, cache_file)
+        # the constraint bounds depend on the parameters (e.g. the current robot position), they are evaluated together
+        # with the solver in a single function call per MPC step
+        x0 = MX.sym('x0', self.opti.nx)
+        p = MX.sym('p', self.opti.np)
+        lam_g0 = MX.sym('lam_g0', self.opti.ng)
+        constraint_bounds = Function('constraint_bounds', [self.opti.p], [self.opti.lbg, self.opti.ubg])
+        lbg, ubg = constraint_bounds(p)
+        sol = self.solver(x0=x0, p=p, lbg=lbg, ubg=ubg, lam_g0=lam_g0)
+        self.mpc_step = Function('mpc_step', [x0, p, lam_g0], [sol['x'], sol['lam_g']], ['x0', 'p', 'lam_g0'],
+                                 ['x', 'lam_g'])
+        # initial guess (and multipliers) for the first solve, following solves are warm started from the previous one
+        self.x_init = self.opti.value(self.opti.x, self.opti.initial())
+        self.lam_g_init = np.zeros(self.opti.ng)
+        # positions of the states X, controls U and slack in the solution vector, used to read X and U directly from the
+        # solution and to build an index map that shifts the horizon variables one time step forward (repeating the
+        # last time step), so that the previous solution can be used as initial guess for the next MPC step
+        self.shift_index = np.arange(self.opti.nx)
+        var_indices = Function('var_index', [self.opti.x], [self.X, self.U, self.slack])(self.shift_index)
+        self.X_index, self.U_index, slack_index = [np.array(var_index, dtype=int) for var_index in var_indices]
+        for var_index in [self.X_index, self.U_index, slack_index]:
+            self.shift_index[var_index] = np.hstack((var_index[:, 1:], var_index[:, -1:]))
+
+    def build_solver(self, nlp, opts, cache_file=None):
+        # create the ipopt solver, and save it to cache_file (if given). The C source generated by the jit compilation
+        # is always written to the working directory (the 'directory' jit option only places the compiled library), so
+        # the solver is built from a fresh temporary directory, which is removed with the generated files afterwards.
+        # The library of a cached solver is kept next to the cache file, where it is extracted again when loaded
+        jit_directory = tempfile.mkdtemp(prefix='sabr_jit_')
+        lib_directory = jit_directory if cache_file is None else os.path.dirname(cache_file)
+        lib_files = set(os.listdir(lib_directory))
+        if 'jit_options' in opts:
+            opts = dict(opts)
+            opts['jit_options'] = dict(opts['jit_options'])
+            opts['jit_options']['directory'] = lib_directory
+        try:
+            curr_directory = os.getcwd()
+        except OSError:
+            # the working directory of the caller no longer exists, there is no directory to return to
+            curr_directory = None
+        try:
+            os.chdir(jit_directory)
+            try:
+                solver = nlpsol('solver', 'ipopt', nlp, opts)
+            finally:
+                if curr_directory is not None:
+                    os.chdir(curr_directory)
+            if cache_file is not None:
+                # the file is written under a temporary name first, so that an interrupted save never leaves a
+                # truncated cache file behind
+                solver.save(cache_file + '.tmp')
+                os.rename(cache_file + '.tmp', cache_file)
+                # only the library is kept next to the cache file, not the object file it was linked from
+                for lib_file in set(os.listdir(lib_directory)) - lib_files:
+                    if lib_file.endswith('.o'):
+                        os.remove(os.path.join(lib_directory, lib_file))
+        finally:
+            shutil.rmtree(jit_directory, ignore_errors=True)
+        return solver
+
+    def solve(self):
+        # solve the SMPC for the current parameter values (robot position, goal, covariances, obstacles) and return
+        # the predicted states X and controls U over the horizon. Raises an error if the solver fails
+        if self.cooperative_localization:
+            if not np.array_equal(self.pos_cov(), self.kalman_gain_cov):
+                self.update_kalman_gains()
+            self.sample_system_noise()
+        sol = self.mpc_step(x0=self.x_init, p=self.opti.value(self.opti.p), lam_g0=self.lam_g_init)
+        x_opt = sol['x'].full().ravel()
+        # warm start the next solve with the shifted solution and the constraint multipliers
+        self.x_init = x_opt[self.shift_index]
+        self.lam_g_init = sol['lam_g']
+        return x_opt[self.X_index], x_opt[self.U_index]
+
+    def solver_timings(self):
+        # wall times and iteration count of the last solve, and the fraction of the total time spent evaluating the
+        # NLP functions (a large fraction means function evaluations are the bottleneck, a small one the solver)
+        stats = self.mpc_step.stats()
+        timings = {key: stats[key] for key in stats if 't_wall' in key or 'iter_count' in key}
+        nlp_time = np.sum([timings[key] for key in timings if key.startswith('t_wall_nlp_')])
+        timings['nlp_fraction'] = float(nlp_time) / timings['t_wall_total'] if timings.get('t_wall_total') else 0
+        return timings
 
     # the nominal next state is calculated for use as a terminal constraint in the objective function
     def next_state_nominal(self, x, u):
-        next_state = mtimes(self.A, x) +  mtimes(self.dT,vertcat(u[0]*cos(x[2]), u[0]*sin(x[2]), u[1]))
+        # A is the identity, so the state is propagated directly instead of multiplying it by A
+        next_state = x + self.dT*vertcat(u[0]*cos(x[2]), u[0]*sin(x[2]), u[1])
         return next_state
 
     # the next state is calculated with consideration of system noise, also considered the true state
-    def next_state_withSystemNoise(self, x, u, system_noise_cov):
-        # the system_noise_covariance will be a flattened 1x4 array, provided by the output of an RNN. We need to
-        # convert it into a 3x3 matrix. We will assume a constant noise in theta however.
-        system_noise_cov_converted = np.array([[self.opti.value(system_noise_cov[0]),
-                                                    self.opti.value(system_noise_cov[1])],
-                                                   [self.opti.value(system_noise_cov[2]),
-                                                    self.opti.value(system_noise_cov[3])]])
-
-        # sample a gaussian distribution of the system_noise covariance (for x and y)
-        system_noise_xy = np.random.multivariate_normal([0, 0], system_noise_cov_converted,
-                                                            check_valid='warn').reshape(2, 1)
-        # sample a gaussian distribution of theta
-        # system_noise_th = np.sqrt(angle_noise_r1)
-        system_noise_th = np.random.normal(0, self.opti.value(self.angle_noise))
-        system_noise = np.append(system_noise_xy, system_noise_th)
-
-        next_state = mtimes(self.A, x) + mtimes(self.dT,vertcat(u[0]*cos(x[2]), u[0]*sin(x[2]), u[1])) + system_noise
+    def next_state_withSystemNoise(self, x, u, w):
+        # the system noise w is a parameter of the solver, sampled before every solve (see sample_system_noise), so
+        # that no random constant is built into the constraints
+        next_state = x + self.dT*vertcat(u[0]*cos(x[2]), u[0]*sin(x[2]), u[1]) + w
         return next_state
 
-    def update_1(self, x, u):
-        return self.next_state_nominal(x, u)
-
-    def update_2(self, x, u, k):
-
-        if self.first_contact == False:
-            return self.update_3(x, u, k)
-        else:
-
-            # obtain the current system noise covariance matrix of robot 1
-            system_noise_cov = self.r1_pos_cov[:, k]
-
-            # obtain the current robot 1 position
-            x_prev_r1 = x
-
-            # propagate robot 1 position
-            xHat_next_r1_noUpdate = self.next_state_nominal(x_prev_r1, u)
-
-            # propagate the system noise covariance matrix of robot 1 from the RNN
-            system_noise_cov_next_r1 = self.r1_pos_cov[:, k+1]
-            P11_noUpdate = np.array([[self.opti.value(system_noise_cov_next_r1[0]),
-                                      self.opti.value(system_noise_cov_next_r1[1])],
-                                     [self.opti.value(system_noise_cov_next_r1[2]),
-                                      self.opti.value(system_noise_cov_next_r1[3])]])
-
-            # obtain robot 2 position and its covariance matrix from the RNN, note robot 2 position, covariance will not
-            # be updated, the update for robot 2 will occur in the MPC script for robot 2 in the next time step
-            xHat_next_r2_noUpdate = self.r2_traj[:, k+1]
-            system_noise_cov_next_r2 = self.r2_pos_cov[:, k+1]
-            P22_noUpdate = np.array([[self.opti.value(system_noise_cov_next_r2[0]),
-                                      self.opti.value(system_noise_cov_next_r2[1])],
-                                     [self.opti.value(system_noise_cov_next_r2[2]),
-                                      self.opti.value(system_noise_cov_next_r2[3])]])
+    def sample_system_noise(self):
+        # the system_noise_covariance will be a flattened 1x4 array per time step, provided by the output of an RNN. We
+        # need to convert it into a 2x2 matrix. We will assume a constant noise in theta however. The covariances of
+        # robot 1 updated by the cooperative localization are used (see update_kalman_gains)
+        system_noise_cov = self.r1_pos_cov_update.T.reshape(self.N + 1, 2, 2)[0:self.N]
+        angle_noise = self.opti.value(self.angle_noise)
 
-            # TODO: x_next_r1 needs to equal the received measurements from the sensors
-            # calculate x_next_r1 (this is used for calculating our measurements)
-            x_next_r1 = self.next_state_withSystemNoise(x_prev_r1, u, system_noise_cov)
+        # sample a gaussian distribution of the system_noise covariance (for x and y) for the whole horizon at once,
+        # the samples are the standard normal samples transformed by the factor eigvec*sqrt(eigval) of the covariances
+        eig_val, eig_vec = np.linalg.eigh(system_noise_cov)
+        noise_factor = eig_vec * np.sqrt(np.clip(eig_val, 0, None))[:, np.newaxis, :]
+        system_noise_xy = np.einsum('kij,kj->ik', noise_factor, np.random.standard_normal((self.N, 2)))
 
-            # TODO: x_next_r2 needs to equal the received measurements from the sensors
-            # calculate x_next_r2
-            x_next_r2 = xHat_next_r2_noUpdate
-
-            # take measurement
-            z = x_next_r1 - x_next_r2
-
-            # obtain the relative measurement uncertainty (based on communication uncertainty)
-            R12 = self.relative_measurement_noise_cov
-
-            # TODO: the self.P21 term must come from robot 2 (CHANGE in the future)
-            # calculate the S matrix
-            P21 = self.P12.T
-            S = P11_noUpdate - self.P12 - P21 + P22_noUpdate + R12
-
-            # calculate the inverse S matrix, if not possible, assume zeros
-            try:
-                S_inv = np.linalg.inv(S)
-
-            except np.linalg.LinAlgError as err:
-                if 'Singular matrix' in str(err):
-                    S_inv = np.zeros((2, 2))
-                else:
-                    S_inv = np.zeros((2, 2))
-
-            # calculate the kalman gain K
-            K = mtimes(P11_noUpdate - self.P12, S_inv)
-
-            # update x_hat of robot 1
-            xHat_next_r1_update = xHat_next_r1_noUpdate[0:2] + mtimes(K, (
-                        z[0:2] - (xHat_next_r1_noUpdate[0:2] - xHat_next_r2_noUpdate[0:2])))
-            xHat_next_r1_update = vertcat(xHat_next_r1_update, x_next_r1[2])
-
-            # update the covariance system noise matrix of robot 1 with the updated matrix
-            P11_update = P11_noUpdate - mtimes(mtimes((P11_noUpdate - self.P12), S_inv), P11_noUpdate - P21)
-
-            # update the covariance system noise matrix for robot 1 and 2
-            self.P12 = mtimes(mtimes(P11_noUpdate, S_inv), P22_noUpdate)
-
-            self.opti.set_value(self.r1_pos_cov[0, k + 1], P11_update[0])
-            self.opti.set_value(self.r1_pos_cov[1, k + 1], P11_update[1])
-            self.opti.set_value(self.r1_pos_cov[2, k + 1], P11_update[2])
-            self.opti.set_value(self.r1_pos_cov[3, k + 1], P11_update[3])
-
-        return xHat_next_r1_update
-
-    def update_3(self, x, u, k):
-
-        # obtain the current system noise covariance matrix of robot 1
-        system_noise_cov = self.r1_pos_cov[:, k]
+        # sample a gaussian distribution of theta
+        # system_noise_th = np.sqrt(angle_noise_r1)
+        system_noise_th = np.random.normal(0, angle_noise, (1, self.N))
 
-        # obtain the current robot 1 position
-        x_prev_r1 = x
+        self.opti.set_value(self.system_noise, np.vstack((system_noise_xy, system_noise_th)))
 
-        # propagate robot 1 position, considering the effects of noise
-        xHat_next_r1_noUpdate = self.next_state_nominal(x_prev_r1, u)
+    def update_1(self, x, u):
+        return self.next_state_nominal(x, u)
 
-        # propagate the system noise covariance matrix of robot 1 from the RNN
-        system_noise_cov_next_r1 = self.r1_pos_cov[:, k+1]
-        P11_noUpdate = np.array([[self.opti.value(system_noise_cov_next_r1[0]),
-                                  self.opti.value(system_noise_cov_next_r1[1])],
-                                 [self.opti.value(system_noise_cov_next_r1[2]),
-                                  self.opti.value(system_noise_cov_next_r1[3])]])
+    def update_kalman(self, x, u, w, K):
 
-        # obtain robot 2 position and its covariance matrix from the RNN, note robot 2 position, covariance will not
-        # be updated, the update for robot 2 will occur in the MPC script for robot 2 in the next time step
-        xHat_next_r2_noUpdate = self.r2_traj[:, k+1]
-        system_noise_cov_next_r2 = self.r2_pos_cov[:, k+1]
-        P22_noUpdate = np.array([[self.opti.value(system_noise_cov_next_r2[0]),
-                                  self.opti.value(system_noise_cov_next_r2[1])],
-                                 [self.opti.value(system_noise_cov_next_r2[2]),
-                                  self.opti.value(system_noise_cov_next_r2[3])]])
+        # propagate robot 1 position
+        xHat_next_r1_noUpdate = self.next_state_nominal(x, u)
 
-        # calculate x_next_r1 (this is used for calculating our measurements)
         # TODO: x_next_r1 needs to equal the received measurements from the sensors
-        x_next_r1 = self.next_state_withSystemNoise(x_prev_r1, u, system_noise_cov)
-
-        # TODO: x_next_r2 needs to equal the received measurements from the sensors
-        # calculate x_next_r2
-        x_next_r2 = xHat_next_r2_noUpdate
-
-        # take measurement
-        z = x_next_r1 - x_next_r2
-
-        # obtain the relative measurement uncertainty (based on communication uncertainty)
-        R12 =  self.relative_measurement_noise_cov
-
-        # calculate the S matrix
-        S = P11_noUpdate + P22_noUpdate + R12
-
-        # calculate the inverse S matrix, if not possible, assume zeros
-        try:
-            S_inv = np.linalg.inv(S)
-
-        except np.linalg.LinAlgError as err:
-            if 'Singular matrix' in str(err):
-                S_inv = np.zeros((2, 2))
-            else:
-                S_inv = np.zeros((2, 2))
-
-        # calculate the kalman gain K
-        K = mtimes(P11_noUpdate, S_inv)
+        # calculate x_next_r1 (this is used for calculating our measurements)
+        x_next_r1 = self.next_state_withSystemNoise(x, u, w)
 
-        # update x_hat of robot 1
-        xHat_next_r1_update = xHat_next_r1_noUpdate[0:2] + mtimes(K, (z[0:2] - (xHat_next_r1_noUpdate[0:2] -
-                                                                                xHat_next_r2_noUpdate[0:2])))
+        # update x_hat of robot 1, the measurement z = x_next_r1 - x_next_r2 is compared with the expected measurement
+        # xHat_next_r1_noUpdate - x_next_r2, where the position of robot 2 cancels out (as it is not updated)
+        xHat_next_r1_update = xHat_next_r1_noUpdate[0:2] + mtimes(K, x_next_r1[0:2] - xHat_next_r1_noUpdate[0:2])
         xHat_next_r1_update = vertcat(xHat_next_r1_update, x_next_r1[2])
 
-        # update the covariance system noise matrix of robot 1 with the updated matrix
-        P11_update = P11_noUpdate - mtimes((mtimes(P11_noUpdate, S_inv), P11_noUpdate))
+        return xHat_next_r1_update
 
-        # update the covariance system noise matrix for robot 1 and 2
-        self.P12 = mtimes(mtimes(P11_noUpdate, S_inv), P22_noUpdate)
+    def pos_cov(self):
+        # the current system noise covariances of robot 1 and 2 (4 x N+1 each, stacked)
+        return np.vstack((np.reshape(self.opti.value(self.r1_pos_cov), (4, self.N+1)),
+                          np.reshape(self.opti.value(self.r2_pos_cov), (4, self.N+1))))
+
+    def update_kalman_gains(self):
+        # calculate the kalman gains of the cooperative localization for every time step from the current system noise
+        # covariances of robot 1 and 2 (from t+1 to N), and the covariances of robot 1 updated by them. The covariance
+        # parameters from the RNN are not changed, so this can be called again whenever they are set
+        self.kalman_gain_cov = self.pos_cov()
+        r1_pos_cov, r2_pos_cov = self.kalman_gain_cov[0:4], self.kalman_gain_cov[4:8]
+        self.r1_pos_cov_update = r1_pos_cov.copy()
+        kalman_gain = np.zeros((4, self.N))
+        # the robots make first contact in the first time step, without cross covariance
+        P12 = None
+        for k in range(0, self.N):
+            K, P11_update, P12 = self.update_2(r1_pos_cov[:, k+1].reshape(2, 2), r2_pos_cov[:, k+1].reshape(2, 2), P12)
+            kalman_gain[:, k] = np.ravel(K, order='F')
+            self.r1_pos_cov_update[:, k+1] = P11_update.ravel()
+        self.opti.set_value(self.kalman_gain, kalman_gain)
+
+    def update_2(self, P11_noUpdate, P22_noUpdate, P12):
+        # P11_noUpdate and P22_noUpdate are the (numeric) 2x2 system noise covariance matrices of robot 1 and 2 from the
+        # RNN, and P12 their cross covariance (None before the first contact), returns the kalman gain K, the updated
+        # covariance matrix of robot 1, and the updated cross covariance
+
+        if P12 is None:
+            return self.update_3(P11_noUpdate, P22_noUpdate)
+        else:
 
-        self.opti.set_value(self.r1_pos_cov[0, k+1], P11_update[0])
-        self.opti.set_value(self.r1_pos_cov[1, k+1], P11_update[1])
-        self.opti.set_value(self.r1_pos_cov[2, k+1], P11_update[2])
-        self.opti.set_value(self.r1_pos_cov[3, k+1], P11_update[3])
+            # obtain the relative measurement uncertainty (based on communication uncertainty), and update the
+            # covariance system noise matrix for robot 1 and 2
+            R12 = self.relative_measurement_noise_cov
+            K, P11_update, P12_update = kalman_update_2x2(P11_noUpdate, P22_noUpdate, P12, R12)
 
-        self.first_contact = True
+        return K, P11_update, P12_update
 
-        return xHat_next_r1_update
+    def update_3(self, P11_noUpdate, P22_noUpdate):
 
-    def distance_pt_line(self, slope, a, intercept, point):
-        A = -slope
-        B = 1
-        C = -intercept
-        d = fabs(A*point[0] + B*point[1] + C) / sqrt(A**2 + B**2)
-        a_slope = a[1]/a[0]
+        # obtain the relative measurement uncertainty (based on communication uncertainty), there is no cross
+        # covariance between robot 1 and 2 before the first contact
+        R12 =  self.relative_measurement_noise_cov
+        K, P11_update, P12_update = kalman_update_2x2(P11_noUpdate, P22_noUpdate, np.zeros((2, 2)), R12)
 
-        x = (a_slope * point[0] - point[1] + intercept) / (a_slope - slope)
-        y = slope * x + intercept
-        dist = if_else(logic_and(sign(y - point[1]) == sign(a[1]), sign(x - point[0]) == sign(a[0])), -1*d, d)
+        return K, P11_update, P12_update
 
-        return dist
     """
     def distance_pt_line_check(self, slope, intercept, point):
         A = -slope
@@ -676,8 +767,10 @@ class SMPC_UGV_Planner():
         plt.ylim(-8, 8)
         self.ax.set_zlim(0, 10)
         # graph robot as a round sphere for simplicity
-        self.ax.plot_surface(self.x_fig + curr_pos[0], self.y_fig + curr_pos[1], self.z_fig,
-                             rstride=4, cstride=4, color='b')
+        np.add(self.x_fig, curr_pos[0], out=self.x_fig_curr)
+        np.add(self.y_fig, curr_pos[1], out=self.y_fig_curr)
+        self.ax.plot_surface(self.x_fig_curr, self.y_fig_curr, self.z_fig,
+                             rstride=1, cstride=1, color='b')
         x_togo = 2 * np.cos(curr_pos[2])
         y_togo = 2 * np.sin(curr_pos[2])
 
@@ -727,11 +820,11 @@ if __name__ == '__main__':
     failure_count = 0
     # initialize obstacles to be seen in a dictionary format. If obstacle should be represented as a circle, the
     # 'vertices' is should be a single [[x,y]] point representing the center of the circle, with 'size' equal to the
-    # radius of the circle, and polygon_type: 1.
-    obs = {1: {'vertices': [[-3.01, -1,0], [-3.02, 1.03,0], [3,1,0], [3.02, -1.05,0]], 'a': [], 'slopes': [], 'intercepts': [],
+    # radius of the circle, and polygon_type: 1. The vertices of a polygon must be given in clockwise order.
+    obs = {1: {'vertices': [[-3.01, -1,0], [-3.02, 1.03,0], [3,1,0], [3.02, -1.05,0]], 'a': [],
                'polygon_type': 4, 'risk': 0.1}}
     #obs.update(
-    #    {2: {'vertices': [[6, 5,0], [7, 7,0], [8, 5.2,0]], 'a': [], 'slopes': [], 'intercepts': [], 'polygon_type': 3,
+    #    {2: {'vertices': [[6, 5,0], [7, 7,0], [8, 5.2,0]], 'a': [], 'polygon_type': 3,
     #         'risk': 0.4}})
     #obs.update(
     #    {3: {'vertices': [[4, 4.1,0]], 'size': 0.7, 'polygon_type': 1, 'risk': 0.4}})
@@ -749,15 +842,15 @@ if __name__ == '__main__':
         SMPC.opti.set_value(SMPC.r1_goal, goal_pos)
         while m.sqrt((curr_pos[0] - goal_pos[0]) ** 2 + (curr_pos[1] - goal_pos[1]) ** 2) > 0.5:
             try:
-                sol = SMPC.opti.solve()
-                u = sol.value(SMPC.U[:, SMPC.N-1])
+                X, U = SMPC.solve()
+                u = U[:, SMPC.N-1]
                 ROS.send_velocity(u)
                 curr_pos = ROS.get_current_pose()
                 curr_pos = np.array(curr_pos).reshape(3, 1)
                 SMPC.check_obstacles(np.concatenate((curr_pos[0], curr_pos[1], [0])))
             except:
                 failure_count += 1
-                u = sol.value(SMPC.U[:, 0])
+                u = U[:, 0]
                 u[1] = 0
                 ROS.send_velocity(u)
                 curr_pos = ROS.get_current_pose()
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'sabr_pkg'))
+from SMPC_ugv import inv2, kalman_update_2x2
+
+
+def test_inv2():
+    M = np.array([[2.0, 1.0], [0.5, 3.0]])
+    np.testing.assert_allclose(inv2(M), np.linalg.inv(M))
+
+
+def test_inv2_small_covariance():
+    # a small but well conditioned matrix is inverted exactly, not regularized
+    M = np.diag([2e-7, 2e-7])
+    np.testing.assert_allclose(inv2(M), np.diag([5e6, 5e6]))
+
+
+def test_inv2_singular():
+    np.testing.assert_array_equal(inv2(np.zeros((2, 2))), np.zeros((2, 2)))
+    assert np.all(np.isfinite(inv2(np.array([[1.0, 2.0], [2.0, 4.0]]))))
+
+
+def test_kalman_update_small_covariance():
+    P = np.diag([1e-7, 1e-7])
+    K, P11_update, P12_update = kalman_update_2x2(P, P, np.zeros((2, 2)), np.zeros((2, 2)))
+    np.testing.assert_allclose(K, 0.5 * np.eye(2))
+    np.testing.assert_allclose(P11_update, 0.5 * P)
+    np.testing.assert_allclose(P12_update, 0.5 * P)
+
+
+def test_kalman_update_numba():
+    # the numba compiled kernels agree with their plain python versions
+    pytest.importorskip('numba')
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        L1, L2 = rng.randn(2, 2), rng.randn(2, 2)
+        P11, P22, R12 = np.dot(L1, L1.T), np.dot(L2, L2.T), 0.1 * np.eye(2)
+        P12 = 0.1 * rng.randn(2, 2)
+        for jit_result, result in zip(kalman_update_2x2(P11, P22, P12, R12),
+                                      kalman_update_2x2.py_func(P11, P22, P12, R12)):
+            np.testing.assert_allclose(jit_result, result, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(inv2(P11), inv2.py_func(P11), rtol=1e-9)